@@ -15,18 +15,36 @@
 # the License.
 
 from setuptools import setup, find_packages
-from yugabyte_pycommon import version
-import subprocess
+import os
+
+
+def get_version():
+    """
+    Reads the version from yugabyte_pycommon/version.py without importing the package itself,
+    which would also import all of its modules.
+    """
+    version_file_path = os.path.join(
+        os.path.dirname(os.path.abspath(__file__)), 'yugabyte_pycommon', 'version.py')
+    version_globals = {}
+    with open(version_file_path) as version_file:
+        exec(version_file.read(), version_globals)
+    return version_globals['__version__']
+
 
 tests_require = [
     'nose',
-    'coverage',
-    'coveralls',
-    'testfixtures',
-    'tox',
     'semver'
 ]
 
+coverage_require = [
+    'coverage',
+    'coveralls'
+]
+
+tox_require = [
+    'tox'
+]
+
 docs_require = [
     'sphinx',
     'sphinx_rtd_theme'
@@ -39,7 +57,7 @@ release_require = [
 
 setup(
     name='yugabyte_pycommon',
-    version=version.__version__,
+    version=get_version(),
     description='Common utilities used in YugaByte Database\'s build infrastructure but could '
                 'also be useful for anyone. E.g. convenient utilities for running external '
                 'programs, logging, etc. Please give YugaByte DB a star at '
@@ -83,6 +101,8 @@ setup(
     # argument.
     extras_require={
         'tests': tests_require,
+        'coverage': coverage_require,
+        'tox': tox_require,
         'docs': docs_require,
         'release': release_require
     },
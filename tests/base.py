@@ -10,8 +10,45 @@
 # or implied.  See the License for the specific language governing permissions and limitations
 # under the License.
 
+import contextlib
+import logging
+
 from unittest import TestCase as PythonTestCase
 
 
+class MemHandler(logging.Handler):
+    """
+    A logging handler that keeps the records it receives in memory.
+    """
+    def __init__(self, level=logging.NOTSET):
+        logging.Handler.__init__(self, level)
+        self.records = []
+
+    def emit(self, record):
+        self.records.append(record)
+
+
 class TestCase(PythonTestCase):
-    pass
+    @classmethod
+    def setUpClass(cls):
+        super(TestCase, cls).setUpClass()
+        # A single handler is attached to the root logger for the whole test class, and tests
+        # reset its records instead of installing and removing a handler every time.
+        cls._log_handler = MemHandler(level=logging.ERROR)
+        logging.getLogger().addHandler(cls._log_handler)
+        cls._log_records = cls._log_handler.records
+
+    @classmethod
+    def tearDownClass(cls):
+        logging.getLogger().removeHandler(cls._log_handler)
+        super(TestCase, cls).tearDownClass()
+
+    if not hasattr(PythonTestCase, 'assertRegex'):
+        # Python 2 name of this method.
+        assertRegex = PythonTestCase.assertRegexpMatches
+
+    if not hasattr(PythonTestCase, 'subTest'):
+        # Python 2 does not have subTest, so table-driven tests just run all cases in one test.
+        @contextlib.contextmanager
+        def subTest(self, msg=None, **params):
+            yield
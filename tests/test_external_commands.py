@@ -13,76 +13,261 @@
 from yugabyte_pycommon.fs_util import get_tmp_file_path, read_file
 from .base import TestCase
 
+import contextlib
 import os
+import re
+import subprocess
+import sys
+import threading
+import unittest
+
+from yugabyte_pycommon import external_calls, run_program, run_programs, ExternalProgramError, \
+    WorkDirContext, program_fails_no_log, program_succeeds_no_log, program_succeeds_empty_output, \
+    check_run_program
+
+_HOME = os.path.expanduser('~')
+
+
+@contextlib.contextmanager
+def _inheritable_fd():
+    """
+    Creates a pipe and makes its write end inheritable, similar to e.g. a make jobserver pipe.
+
+    :return: the inheritable file descriptor
+    """
+    read_fd, write_fd = os.pipe()
+    try:
+        os.set_inheritable(write_fd, True)
+        yield write_fd
+    finally:
+        os.close(read_fd)
+        os.close(write_fd)
+
+
+def _exit_code_pattern(cmd, exit_code):
+    return "Non-zero exit code %d from external program {{ %s }} running in '.*'." % (
+        exit_code, re.escape(cmd))
+
+
+def _output_section_pattern(cmd, stream_type, text):
+    return ("Standard %s from external program {{ %s }} running in '.*':\n%s\n"
+            "\\(end of standard %s\\)") % (
+        stream_type, re.escape(cmd), re.escape(text), stream_type)
+
+
+# Regular expressions for the expected error messages are compiled once at import time.
+_LOG_ERROR_STDOUT_CMD = "echo Output!; exit 1"
+_LOG_ERROR_STDOUT_RE = re.compile('\n'.join([
+    _exit_code_pattern(_LOG_ERROR_STDOUT_CMD, 1),
+    _output_section_pattern(_LOG_ERROR_STDOUT_CMD, 'output', 'Output!')
+]))
+
+_LOG_ERROR_STDOUT_STDERR_CMD = "echo Output!; echo Error! >&2; exit 1"
+_LOG_ERROR_STDOUT_STDERR_RE = re.compile('\n'.join([
+    _exit_code_pattern(_LOG_ERROR_STDOUT_STDERR_CMD, 1),
+    _output_section_pattern(_LOG_ERROR_STDOUT_STDERR_CMD, 'output', 'Output!'),
+    '.*',
+    _output_section_pattern(_LOG_ERROR_STDOUT_STDERR_CMD, 'error', 'Error!')
+]))
+
+_ERROR_MSG_CMD = 'echo " This is stdout! "; echo " This is stderr! " >&2; exit 1'
+_ERROR_MSG_RE = re.compile('\n'.join([
+    _exit_code_pattern(_ERROR_MSG_CMD, 1),
+    _output_section_pattern(_ERROR_MSG_CMD, 'output', ' This is stdout!'),
+    '',
+    _output_section_pattern(_ERROR_MSG_CMD, 'error', ' This is stderr!')
+]))
+
+_STDOUT_AND_STDERR_TOGETHER_CASES = [
+    ('echo foo', re.compile(_output_section_pattern('echo foo', 'output', 'foo'))),
+    ('echo bar >&2', re.compile(_output_section_pattern('echo bar >&2', 'error', 'bar'))),
+    ('echo foo; echo bar >&2', re.compile('\n'.join([
+        _output_section_pattern('echo foo; echo bar >&2', 'output', 'foo'),
+        '',
+        _output_section_pattern('echo foo; echo bar >&2', 'error', 'bar')
+    ])))
+]
 
-from yugabyte_pycommon import run_program, quote_for_bash, ExternalProgramError, WorkDirContext, \
-    program_fails_no_log, program_succeeds_no_log, program_succeeds_empty_output, check_run_program
-import logging
-from testfixtures import LogCapture
 
 class ExternalCommandsTestCase(TestCase):
     def test_run_program_noerror(self):
-        result = run_program("true")
-        self.assertEquals(0, result.returncode)
-        self.assertEquals('', result.stdout)
-        self.assertEquals('', result.stderr)
+        result = run_program(["true"])
+        self.assertEqual(0, result.returncode)
+        self.assertEqual('', result.stdout)
+        self.assertEqual('', result.stderr)
+
+    def test_cmd_line_str(self):
+        self.assertEqual("echo 'foo bar' 1", run_program(['echo', 'foo bar', 1]).cmd_line_str)
+        self.assertEqual('echo foo >&2', run_program('echo foo >&2').cmd_line_str)
+
+    def test_internal_names_not_exported(self):
+        import yugabyte_pycommon
+        for name in ['OPEN_FDS_DIR', 'SIGNALS_TO_RESET_IN_CHILD', 'OUTPUT_READ_CHUNK_SIZE',
+                     'SIMPLE_SHELL_COMMAND_CHARS', 'SHELL_KEYWORDS_AND_BUILTINS']:
+            self.assertFalse(hasattr(yugabyte_pycommon, name))
+            self.assertFalse(hasattr(yugabyte_pycommon, '_' + name))
+
+    def test_simple_shell_commands(self):
+        self.assertEqual(run_program(['uname', '-s']).stdout, run_program('uname -s').stdout)
+        # Simple commands do not start a shell, so they still work if the shell cannot be found.
+        old_shell = os.environ.get('SHELL')
+        os.environ['SHELL'] = '/nonexistent/shell'
+        try:
+            self.assertEqual(run_program(['uname', '-s']).stdout, run_program('uname -s').stdout)
+            with self.assertRaises(OSError):
+                run_program('echo foo')
+        finally:
+            if old_shell is None:
+                del os.environ['SHELL']
+            else:
+                os.environ['SHELL'] = old_shell
+        # Commands using shell features are still run by the shell.
+        self.assertEqual('foo\n', run_program('FOO=foo printenv FOO').stdout)
+        self.assertEqual(3, run_program('exit 3', error_ok=True).returncode)
+        # A program that cannot be found is reported by the shell.
+        self.assertEqual(127, run_program('nonexistent-program-name', error_ok=True).returncode)
+        # Extra arguments are meant for the shell, so the command is not run directly.
+        self.assertEqual('-c uname -s\n', run_program('uname -s', executable='/bin/echo').stdout)
+        self.assertEqual(run_program(['uname', '-s']).stdout,
+                         run_program('uname -s', stdin=subprocess.PIPE).stdout)
+
+    def test_simple_shell_commands_unknown_builtins(self):
+        # Builtins that are not known to be builtins, and for which there is no program with the
+        # same name, are still run by the shell.
+        shell_builtins = external_calls._SHELL_KEYWORDS_AND_BUILTINS
+        external_calls._SHELL_KEYWORDS_AND_BUILTINS = frozenset()
+        try:
+            for cmd in ['ulimit -n', 'umask']:
+                with self.subTest(cmd=cmd):
+                    self.assertEqual(
+                        run_program(['bash', '-c', cmd]).stdout, run_program(cmd).stdout)
+        finally:
+            external_calls._SHELL_KEYWORDS_AND_BUILTINS = shell_builtins
+
+    def test_program_path(self):
+        self.assertEqual(os.path.realpath('/bin/true'), run_program(['/bin/true']).program_path)
 
     def test_exit_codes(self):
-        for exit_code in [0, 1, 2, 3, 10, 20, 100, 150, 200, 250, 255]:
-            result = run_program("exit %d" % exit_code, shell=True, error_ok=exit_code != 0)
-            self.assertEquals(exit_code, result.returncode)
+        exit_codes = [0, 1, 2, 3, 10, 20, 100, 150, 200, 250, 255]
+        results = run_programs(["exit %d" % exit_code for exit_code in exit_codes],
+                               error_ok=True, capture_output=False)
+        self.assertEqual(exit_codes, [result.returncode for result in results])
+
+    def test_run_programs(self):
+        results = run_programs(
+            [['true'], ['false'], 'echo foo; exit 3', ['echo', 'bar']], concurrency=2,
+            error_ok=True)
+        self.assertEqual([0, 1, 3, 0], [result.returncode for result in results])
+        self.assertEqual('foo\n', results[2].stdout)
+        self.assertEqual('bar\n', results[3].stdout)
+
+        self.assertEqual([], run_programs([]))
+        with self.assertRaises(ExternalProgramError):
+            run_programs([['true'], ['false']], capture_output=False)
+
+    def test_exit_codes_no_capture(self):
+        for exit_code in [0, 1, 255]:
+            self.assertEqual(exit_code, run_program(
+                ['sh', '-c', 'exit %d' % exit_code], error_ok=True,
+                capture_output=False).returncode)
+        self.assertEqual(-15, run_program(
+            ['sh', '-c', 'kill -TERM $$'], error_ok=True, capture_output=False).returncode)
+        with self.assertRaises(OSError):
+            run_program(['/nonexistent/program'], capture_output=False)
+
+    @unittest.skipIf(not os.path.isdir('/proc/self/fd') or sys.version_info < (3, 4),
+                     "Requires /proc/self/fd and os.set_inheritable")
+    def test_no_fds_inherited(self):
+        with _inheritable_fd() as fd:
+            self.assertEqual(0, run_program(
+                ['sh', '-c', 'test ! -e /proc/self/fd/%d' % fd], capture_output=False,
+                error_ok=True).returncode)
+
+            # Helpers that discard the output of the program.
+            fd_is_not_open_cmd = ['sh', '-c', 'test ! -e /proc/self/fd/%d' % fd]
+            self.assertTrue(program_succeeds_no_log(fd_is_not_open_cmd))
+            self.assertFalse(program_fails_no_log(fd_is_not_open_cmd))
+            self.assertEqual(0, check_run_program(fd_is_not_open_cmd))
+
+            # A shell command, which is run using $SHELL -c.
+            self.assertTrue(program_succeeds_no_log('test ! -e /proc/self/fd/%d' % fd))
+
+            # A simple command, which is run without a shell. The descriptor that ls uses to list
+            # the directory is the lowest one available, and the pipe's write end is above that.
+            fds_list_prefix = get_tmp_file_path(prefix='test_no_fds_inherited')
+            run_program('ls /proc/self/fd', stdout_stderr_prefix=fds_list_prefix)
+            self.assertNotIn(str(fd), read_file(fds_list_prefix + '.out').split())
 
     def test_error_reporing(self):
         with self.assertRaises(ExternalProgramError):
-            run_program('false')
+            run_program(['false'], capture_output=False)
 
     def test_work_dir_context(self):
         old_work_dir = os.getcwd()
-        for d in ['/tmp', os.path.expanduser('~')]:
+        for d in ['/tmp', _HOME]:
             with WorkDirContext(d):
-                self.assertEquals(d, os.getcwd())
-                self.assertEquals(d, run_program('pwd').stdout.strip())
+                # The current directory of the test process itself does not change.
+                self.assertEqual(old_work_dir, os.getcwd())
+                self.assertEqual(d, run_program(['pwd']).stdout.strip())
+                self.assertEqual(
+                    [d, d], [result.stdout.strip() for result in run_programs([['pwd'], 'pwd'])])
+
+        with WorkDirContext('/'):
+            with WorkDirContext('tmp'):
+                self.assertEqual('/tmp', run_program(['pwd']).stdout.strip())
+            self.assertEqual('/', run_program(['pwd']).stdout.strip())
+            self.assertEqual('/tmp', run_program(['pwd'], cwd='tmp').stdout.strip())
+
+            # Entering a directory that does not exist fails right away and does not change the
+            # directory that programs are run in.
+            with self.assertRaises(OSError):
+                with WorkDirContext('/nonexistent_dir_for_work_dir_context_test'):
+                    pass
+            self.assertEqual('/', run_program(['pwd']).stdout.strip())
+
+        self.assertEqual(old_work_dir, os.getcwd())
 
-        self.assertEquals(old_work_dir, os.getcwd())
+    def test_work_dir_context_other_threads(self):
+        old_work_dir = os.getcwd()
+        results = []
+        with WorkDirContext('/tmp'):
+            # The context only applies to the thread that entered it.
+            thread = threading.Thread(
+                target=lambda: results.append(run_program(['pwd']).stdout.strip()))
+            thread.start()
+            thread.join()
+            self.assertEqual([old_work_dir], results)
+            self.assertEqual(['/tmp'], [result.stdout.strip()
+                                        for result in run_programs([['pwd']], concurrency=2)])
 
     def _capture_error_log_from_cmd(self, cmd):
-        with LogCapture(level=logging.ERROR) as captured_logs:
-            run_program(cmd, error_ok=True, report_errors=True)
-        return str(captured_logs).strip()
+        del self._log_records[:]
+        run_program(cmd, error_ok=True, report_errors=True)
+        return '\n'.join(record.getMessage() for record in self._log_records).strip()
 
     def test_log_error(self):
-        self.assertRegexpMatches(
-            self._capture_error_log_from_cmd("echo Output!; exit 1"), r"""
-Non-zero exit code 1 from external program {{ echo Output!; exit 1 }} running in '.*'.
-Standard output from external program {{ echo Output!; exit 1 }} running in '.*':
-Output!
-\(end of standard output\)""".strip())
-
-        self.assertRegexpMatches(
-            self._capture_error_log_from_cmd("echo Output!; echo Error! >&2; exit 1"), r"""
-Non-zero exit code 1 from external program {{ echo Output!; echo Error! >&2; exit 1 }} running in '.*'.
-Standard output from external program {{ echo Output!; echo Error! >&2; exit 1 }} running in '.*':
-Output!
-\(end of standard output\)
-.*
-Standard error from external program {{ echo Output!; echo Error! >&2; exit 1 }} running in '.*':
-Error!
-\(end of standard error\)""".strip())
+        self.assertRegex(
+            self._capture_error_log_from_cmd(_LOG_ERROR_STDOUT_CMD), _LOG_ERROR_STDOUT_RE)
+        self.assertRegex(
+            self._capture_error_log_from_cmd(_LOG_ERROR_STDOUT_STDERR_CMD),
+            _LOG_ERROR_STDOUT_STDERR_RE)
 
     def test_shortcut_functions(self):
-        self.assertTrue(program_fails_no_log('false'))
-        self.assertFalse(program_fails_no_log('true'))
-        self.assertFalse(program_succeeds_no_log('false'))
-        self.assertTrue(program_succeeds_no_log('true'))
-        self.assertTrue(program_succeeds_empty_output('true'))
-        self.assertFalse(program_succeeds_empty_output('false'))
+        self.assertTrue(program_fails_no_log(['false'], capture_output=False))
+        self.assertFalse(program_fails_no_log(['true'], capture_output=False))
+        self.assertFalse(program_succeeds_no_log(['false'], capture_output=False))
+        self.assertTrue(program_succeeds_no_log(['true'], capture_output=False))
+        self.assertTrue(program_fails_no_log('echo foo; echo bar >&2; exit 1'))
+        self.assertTrue(program_succeeds_no_log(['uname', '-s']))
+        self.assertTrue(program_succeeds_empty_output(['true']))
+        self.assertFalse(program_succeeds_empty_output(['false']))
         with self.assertRaises(ExternalProgramError):
             self.assertTrue(program_succeeds_empty_output('echo foo'))
 
     def test_check_run_program(self):
-        self.assertEquals(0, check_run_program('true'))
+        self.assertEqual(0, check_run_program(['true']))
         with self.assertRaises(ExternalProgramError):
-            check_run_program('false')
+            check_run_program(['false'])
 
     def test_no_output_capture(self):
         result = run_program(
@@ -92,48 +277,52 @@ Error!
         self.assertIsNone(result.stderr)
         self.assertFalse(result.output_captured)
 
+    def test_max_output_bytes(self):
+        result = run_program(['yes'], max_output_bytes=1000, error_ok=True)
+        self.assertTrue(result.output_truncated)
+        self.assertTrue(result.failure())
+        self.assertEqual('y\n' * 500, result.stdout)
+        self.assertEqual('', result.stderr)
+
+        # Only the output that was cut is labelled as truncated.
+        result = run_program('echo err >&2; exec yes', max_output_bytes=1000, error_ok=True)
+        self.assertTrue(result.stdout_truncated)
+        self.assertFalse(result.stderr_truncated)
+        self.assertEqual('err\n', result.stderr)
+        self.assertIn('Standard output (truncated)', result.error_msg)
+        self.assertIn('Standard error from', result.error_msg)
+
+        result = run_program('echo foo; echo bar >&2', max_output_bytes=1000)
+        self.assertFalse(result.output_truncated)
+        self.assertEqual('foo\n', result.stdout)
+        self.assertEqual('bar\n', result.stderr)
+
+    def test_max_output_bytes_read_error(self):
+        # An error while reading the output is raised instead of returning partial output.
+        chunk_size = external_calls._OUTPUT_READ_CHUNK_SIZE
+        external_calls._OUTPUT_READ_CHUNK_SIZE = None
+        try:
+            with self.assertRaises(TypeError):
+                run_program(['yes'], max_output_bytes=1000)
+        finally:
+            external_calls._OUTPUT_READ_CHUNK_SIZE = chunk_size
+
+    @unittest.skipIf(sys.version_info[0] < 3, "Output is not decoded on Python 2")
+    def test_invalid_utf8_output(self):
+        result = run_program("printf 'abc\\377def'")
+        self.assertEqual(u'abc\ufffddef', result.stdout)
+
     def test_error_msg(self):
         # No error message if exit code is 0.
-        self.assertIsNone(run_program('true').error_msg)
+        self.assertIsNone(run_program(['true']).error_msg)
 
-        result = run_program(
-            'echo " This is stdout! "; echo " This is stderr! " >&2; exit 1', error_ok=True)
-        self.assertRegexpMatches(
-            result.error_msg.strip(),
-"""
-Non-zero exit code 1 from external program {{ echo " This is stdout! "; echo " This is stderr! " >&2; exit 1 }} running in '.*'.
-Standard output from external program {{ echo " This is stdout! "; echo " This is stderr! " >&2; exit 1 }} running in '.*':
- This is stdout!
-\(end of standard output\)
-
-Standard error from external program {{ echo " This is stdout! "; echo " This is stderr! " >&2; exit 1 }} running in '.*':
- This is stderr!
-\(end of standard error\)
-""".strip())
+        result = run_program(_ERROR_MSG_CMD, error_ok=True)
+        self.assertRegex(result.error_msg.strip(), _ERROR_MSG_RE)
 
     def test_stdout_and_stderr_together(self):
-        self.assertRegexpMatches(
-            run_program('echo foo').get_stdout_and_stderr_together().strip(), r"""
-Standard output from external program {{ echo foo }} running in '.*':
-foo
-\(end of standard output\)
-            """.strip())
-        self.assertRegexpMatches(
-            run_program('echo bar >&2').get_stdout_and_stderr_together().strip(), r"""
-Standard error from external program {{ echo bar >&2 }} running in '.*':
-bar
-\(end of standard error\)
-            """.strip())
-        self.assertRegexpMatches(
-            run_program('echo foo; echo bar >&2').get_stdout_and_stderr_together().strip(), r"""
-Standard output from external program {{ echo foo; echo bar >&2 }} running in '.*':
-foo
-\(end of standard output\)
-
-Standard error from external program {{ echo foo; echo bar >&2 }} running in '.*':
-bar
-\(end of standard error\)
-            """.strip())
+        for cmd, pattern in _STDOUT_AND_STDERR_TOGETHER_CASES:
+            self.assertRegex(
+                run_program(cmd).get_stdout_and_stderr_together().strip(), pattern)
 
     def test_redirect_output_to_files(self):
         stdout_path = get_tmp_file_path(prefix='test_redirect_to_file', suffix='.stdout')
@@ -160,3 +349,17 @@ bar
         self.assertEqual(
             "And now 3 slashes: \\\\\\. And four: \\\\\\\\.\n",
             read_file(out_err_prefix + '.err'))
+
+        # Relative output paths are interpreted relative to the WorkDirContext.
+        out_err_dir, out_err_name = os.path.split(out_err_prefix)
+        with WorkDirContext(out_err_dir):
+            result = run_program('echo Foo; echo Bar >&2', stdout_stderr_prefix=out_err_name)
+        self.assertEqual(out_err_prefix + '.out', result.stdout_path)
+        self.assertEqual("Foo\n", result.get_stdout())
+        self.assertEqual("Bar\n", result.get_stderr())
+
+        # Output of a program run without a shell can be saved to files as well.
+        result = run_program(['echo', 'Foo'], stdout_stderr_prefix=out_err_prefix)
+        self.assertEqual(0, result.returncode)
+        self.assertEqual("Foo\n", read_file(out_err_prefix + '.out'))
+        self.assertEqual("", read_file(out_err_prefix + '.err'))
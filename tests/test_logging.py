@@ -18,7 +18,7 @@ from .base import TestCase
 from yugabyte_pycommon import init_logging
 
 
-class FileSystemUtilTestCase(TestCase):
-    def test_mkdir_p(self):
+class LoggingTestCase(TestCase):
+    def test_init_logging(self):
         for log_level in [logging.INFO, logging.WARN, logging.DEBUG, logging.ERROR, logging.FATAL]:
             init_logging(log_level=log_level)
\ No newline at end of file
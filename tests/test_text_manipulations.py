@@ -10,8 +10,6 @@
 # or implied.  See the License for the specific language governing permissions and limitations
 # under the License.
 #
-import os
-import tempfile
 import subprocess
 
 from yugabyte_pycommon import trim_long_text, run_program, quote_for_bash
@@ -20,27 +18,36 @@ from .base import TestCase
 
 
 class TextManipulationsTestCase(TestCase):
+    LONG_TEXT = "\n".join(map(str, range(1, 11)))
+
     def test_trim_long_text(self):
-        long_text = "\n".join([str(i) for i in range(1, 11)])
-        self.assertEquals(long_text, trim_long_text(long_text, 20))
-        self.assertEquals(long_text, trim_long_text(long_text, 10))
-        self.assertEquals(
-            "1\n2\n3\n4\n(2 lines skipped)\n7\n8\n9\n10", trim_long_text(long_text, 9))
-        self.assertEquals(
-            """1
-2
-(6 lines skipped)
-9
-10""", trim_long_text(long_text, 5))
+        for text, max_lines, expected in [
+            (self.LONG_TEXT, 20, self.LONG_TEXT),
+            (self.LONG_TEXT, 10, self.LONG_TEXT),
+            (self.LONG_TEXT, 9, "1\n2\n3\n4\n(2 lines skipped)\n7\n8\n9\n10"),
+            (self.LONG_TEXT, 5, "1\n2\n(6 lines skipped)\n9\n10"),
+            (self.LONG_TEXT, 4, "1\n(8 lines skipped)\n10"),
+            (self.LONG_TEXT, 3, "1\n(8 lines skipped)\n10"),
+            (self.LONG_TEXT, 2, "1\n(8 lines skipped)\n10"),
+            (self.LONG_TEXT, 1, "1\n(8 lines skipped)\n10"),
+            ('a\r\nb\r\nc\r\nd\r\ne\r\n', 3, 'a\n(3 lines skipped)\ne'),
+            ('a\r\nb\r\nc\r\nd\r\ne\r\nf\r\ng', 5, 'a\nb\n(3 lines skipped)\nf\ng'),
+        ]:
+            with self.subTest(text=text, max_lines=max_lines):
+                self.assertEqual(expected, trim_long_text(text, max_lines))
+
+    def test_trim_long_text_trailing_newline(self):
+        self.assertEqual(self.LONG_TEXT + "\n", trim_long_text(self.LONG_TEXT + "\n", 10))
+        self.assertEqual("1\n2\n(6 lines skipped)\n9\n10",
+                         trim_long_text(self.LONG_TEXT + "\n", 5))
 
-        self.assertEquals('1\n2\n(6 lines skipped)\n9\n10', trim_long_text(long_text, 5))
-        self.assertEquals("1\n(8 lines skipped)\n10", trim_long_text(long_text, 4))
-        self.assertEquals("1\n(8 lines skipped)\n10", trim_long_text(long_text, 3))
-        self.assertEquals("1\n(8 lines skipped)\n10", trim_long_text(long_text, 2))
-        self.assertEquals("1\n(8 lines skipped)\n10", trim_long_text(long_text, 1))
+    def test_trim_long_text_crlf(self):
+        crlf_text = self.LONG_TEXT.replace("\n", "\r\n") + "\r\n"
+        self.assertEqual(crlf_text, trim_long_text(crlf_text, 10))
+        self.assertEqual("1\n2\n(6 lines skipped)\n9\n10", trim_long_text(crlf_text, 5))
 
     def test_quote_for_bash(self):
-        for s in [
+        inputs = [
             "\\" * 1,
             "\\" * 2,
             "\\" * 3,
@@ -72,24 +79,34 @@ class TextManipulationsTestCase(TestCase):
             ' .',
             '. ',
             '* ',
-            ' *'
-        ]:
-            quoted_s = quote_for_bash(s)
-            tmp_file_path = None
-
-            try:
-                with tempfile.NamedTemporaryFile(suffix='.sh', delete=False) as tmp_file:
-                    cmd = 'echo -n ' + quoted_s
-                    tmp_file.write(cmd.encode('utf-8'))
-                    tmp_file_path = tmp_file.name
+            ' *',
+            'foo&bar',
+            'foo|bar',
+            'foo>bar',
+            'foo<bar',
+            '`foo`',
+            '#foo',
+            '~',
+            'foo?',
+            '[ab]',
+            'foo\tbar',
+            'foo\nbar'
+        ]
 
-                result = subprocess.check_output(
-                        ['bash', tmp_file_path]).decode('utf-8')
-                self.assertEqual(s, result,
-                                 "For input string: [[ {} ]], quote_for_bash produced [[ {} ]], "
-                                 "but echo -n with that argument returned: [[ {} ]]".format(
-                                     s, quoted_s, result
-                                 ))
-            finally:
-                if False and tmp_file_path and os.path.exists(tmp_file_path):
-                    os.remove(tmp_file_path)
+        # Echo all the quoted strings from a single Bash process, separating the outputs with NUL
+        # characters, instead of starting a new Bash process for each input string. The script is
+        # piped to Bash's standard input, so it is parsed the same way as a script file would be.
+        quoted_inputs = [quote_for_bash(s) for s in inputs]
+        script = '\n'.join("echo -n %s; printf '\\0'" % quoted_s for quoted_s in quoted_inputs)
+        bash_process = subprocess.Popen(
+            ['bash', '-s'], stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+        output = bash_process.communicate(script.encode('utf-8'))[0]
+        self.assertEqual(0, bash_process.returncode)
+        results = output.decode('utf-8').split('\0')[:-1]
+        self.assertEqual(len(inputs), len(results))
+        for s, quoted_s, result in zip(inputs, quoted_inputs, results):
+            self.assertEqual(s, result,
+                             "For input string: [[ {} ]], quote_for_bash produced [[ {} ]], "
+                             "but echo -n with that argument returned: [[ {} ]]".format(
+                                 s, quoted_s, result
+                             ))
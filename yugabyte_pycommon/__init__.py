@@ -19,3 +19,4 @@ from yugabyte_pycommon.external_calls import *
 from yugabyte_pycommon.logging_util import *
 from yugabyte_pycommon.text_manipulation import *
 from yugabyte_pycommon.fs_util import *
+from yugabyte_pycommon.collection_util import *
@@ -10,7 +10,10 @@
 # or implied.  See the License for the specific language governing permissions and limitations
 # under the License.
 
-import itertools
+import collections
+import operator
+
+_STR_TYPE_SET = set([str])
 
 
 def group_by_to_list(arr, key_fn):
@@ -26,7 +29,12 @@ def group_by_to_list(arr, key_fn):
     [(0, [201, 300, 402]), (1, [100, 301, 400]), (2, [401])]
 
     """
-    return [(k, list(v)) for (k, v) in itertools.groupby(sorted(arr, key=key_fn), key_fn)]
+    # Compute the key once per element and collect the groups in one pass, then only sort the
+    # distinct keys.
+    groups = collections.defaultdict(list)
+    for item in arr:
+        groups[key_fn(item)].append(item)
+    return sorted(groups.items(), key=operator.itemgetter(0))
 
 
 def group_by_to_dict(arr, key_fn):
@@ -58,12 +66,20 @@ def make_list(obj):
     >>> make_list(set([10, 20, None, 'a', 'z']))
     [10, 20, None, 'a', 'z']
     """
-    if isinstance(obj, str):
+    # Check the exact type first, which is cheaper than isinstance, and only fall back to
+    # isinstance for subclasses.
+    obj_type = type(obj)
+    if obj_type is list or obj_type is tuple:
+        return list(obj)
+    if obj_type is str or isinstance(obj, str):
         return [obj]
-    if isinstance(obj, set):
+    if obj_type is set or isinstance(obj, set):
+        if set(map(type, obj)) == _STR_TYPE_SET:
+            # Strings are their own string representation, so they can be compared directly.
+            return sorted(obj)
         # Sort by string representation because objects of different types are not comparable in
         # Python 3.
-        return sorted(obj, key=lambda item: str(item))
+        return sorted(obj, key=str)
     return list(obj)
 
 
@@ -74,7 +90,15 @@ def make_set(obj):
 
     :param obj: a collection object
     :return: a set created from the given object
+
+    >>> make_set('asdf') == set(['asdf'])
+    True
+    >>> make_set(['a', 'b', 'a']) == set(['a', 'b'])
+    True
     """
     if isinstance(obj, set):
         return obj
-    return set(make_list(obj))
+    if isinstance(obj, str):
+        return set([obj])
+    # Unlike make_list, there is no need to sort anything here.
+    return set(obj)
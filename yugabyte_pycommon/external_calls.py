@@ -14,15 +14,16 @@
 Utilities for running external commands.
 """
 
+import errno
 import os
 import sys
 import logging
+import signal
 import subprocess
-import tempfile
 import threading
 
 from yugabyte_pycommon.text_manipulation import cmd_line_args_to_str, decode_utf8, trim_long_text, \
-    quote_for_bash
+    _BASH_SAFE_CHARS
 from yugabyte_pycommon.logging_util import is_verbose_mode
 
 
@@ -31,27 +32,113 @@ DEFAULT_MAX_LINES_TO_SHOW = 1000
 
 DEFAULT_UNIX_SHELL = 'bash'
 
-
-class ProgramResult:
+# Default maximum number of programs that run_programs runs at the same time.
+DEFAULT_CONCURRENCY = 8
+
+# Signals that Popen resets to their default handlers in the child process (see the restore_signals
+# parameter), because Python ignores them. We do the same when using os.posix_spawnp.
+_SIGNALS_TO_RESET_IN_CHILD = [
+    getattr(signal, signal_name) for signal_name in ['SIGPIPE', 'SIGXFZ', 'SIGXFSZ']
+    if hasattr(signal, signal_name)
+]
+
+# Directory listing the open file descriptors of the current process, if there is one. /dev/fd is
+# not used, as e.g. on FreeBSD without fdescfs mounted it only lists standard input, output, and
+# error, so other inheritable descriptors would be missed.
+_OPEN_FDS_DIR = '/proc/self/fd' if os.path.isdir('/proc/self/fd') else None
+
+# Characters that a shell command line can consist of to be run as a simple command without a
+# shell: arguments that do not need quoting, separated by spaces.
+_SIMPLE_SHELL_COMMAND_CHARS = _BASH_SAFE_CHARS | frozenset(' ')
+
+# Bash keywords and builtin commands. Simple commands starting with these are still run by the
+# shell, as they are either not available as separate programs or behave differently if they are.
+_SHELL_KEYWORDS_AND_BUILTINS = frozenset([
+    '!', '.', ':', '[', '[[', ']]', '{', '}', 'alias', 'bg', 'bind', 'break', 'builtin', 'caller',
+    'case', 'cd', 'command', 'compgen', 'complete', 'compopt', 'continue', 'coproc', 'declare',
+    'dirs', 'disown', 'do', 'done', 'echo', 'elif', 'else', 'enable', 'esac', 'eval', 'exec',
+    'exit', 'export', 'false', 'fc', 'fg', 'fi', 'for', 'function', 'getopts', 'hash', 'help',
+    'history', 'if', 'in', 'jobs', 'kill', 'let', 'local', 'logout', 'mapfile', 'popd', 'printf',
+    'pushd', 'pwd', 'read', 'readarray', 'readonly', 'return', 'select', 'set', 'shift', 'shopt',
+    'source', 'suspend', 'test', 'then', 'time', 'times', 'trap', 'true', 'type', 'typeset',
+    'ulimit', 'umask', 'unalias', 'unset', 'until', 'wait', 'while'
+])
+
+# Size of chunks to read the output of external programs in when limiting its size.
+_OUTPUT_READ_CHUNK_SIZE = 65536
+
+
+class ProgramResult(object):
     """
     This represents the result of executing an external program.
     """
+    # Many results may be created by scripts that run a lot of external programs, so avoid having
+    # a per-instance dictionary.
+    __slots__ = [
+        'cmd_line', '_cmd_line_str', 'returncode', 'stdout', 'stderr', 'stdout_path',
+        'stderr_path', '_program_path', '_real_program_path', 'work_dir',
+        '_invocation_details_str', 'max_lines_to_show', 'output_captured', 'stdout_truncated',
+        'stderr_truncated', '_error_msg'
+    ]
+
     def __init__(self, cmd_line, cmd_line_str, returncode, stdout, stdout_path, stderr,
-                 stderr_path, program_path, invocation_details_str, max_lines_to_show,
-                 output_captured):
+                 stderr_path, program_path, work_dir, max_lines_to_show, output_captured,
+                 stdout_truncated=False, stderr_truncated=False):
         self.cmd_line = cmd_line
-        self.cmd_line_str = cmd_line_str
+        self._cmd_line_str = cmd_line_str
         self.returncode = returncode
         self.stdout = stdout
         self.stderr = stderr
         self.stdout_path = stdout_path
         self.stderr_path = stderr_path
-        self.program_path = program_path
-        self.invocation_details_str = invocation_details_str
+        self._program_path = program_path
+        self._real_program_path = None
+        self.work_dir = work_dir
+        self._invocation_details_str = None
         self.max_lines_to_show = max_lines_to_show
         self.output_captured = output_captured
+        self.stdout_truncated = stdout_truncated
+        self.stderr_truncated = stderr_truncated
+        self._error_msg = None
+
+    @property
+    def output_truncated(self):
+        """
+        :return: whether standard output or standard error of the program was truncated
+        """
+        return self.stdout_truncated or self.stderr_truncated
 
-        self._set_error_msg()
+    @property
+    def program_path(self):
+        """
+        :return: the real path of the program (the first command-line argument), with symlinks
+                 resolved. This is only computed on first access.
+        """
+        if self._real_program_path is None:
+            self._real_program_path = os.path.realpath(self._program_path)
+        return self._real_program_path
+
+    @property
+    def cmd_line_str(self):
+        """
+        :return: the command line of the external program as a single string. Unless the program
+                 was specified as a single string to begin with, this is only computed on first
+                 access.
+        """
+        if self._cmd_line_str is None:
+            self._cmd_line_str = cmd_line_args_to_str(self.cmd_line)
+        return self._cmd_line_str
+
+    @property
+    def invocation_details_str(self):
+        """
+        :return: a description of the external program invocation to use in log and error
+                 messages. This is only computed on first access.
+        """
+        if self._invocation_details_str is None:
+            self._invocation_details_str = _get_invocation_details_str(
+                self.cmd_line_str, self.work_dir, self.stdout_path, self.stderr_path)
+        return self._invocation_details_str
 
     def success(self):
         """
@@ -83,19 +170,24 @@ class ProgramResult:
         sys.stdout.write(self.get_stdout_and_stderr_together())
         sys.stdout.flush()
 
-    def _set_error_msg(self):
+    @property
+    def error_msg(self):
+        """
+        :return: an error message describing the failure of the external program, including its
+                 standard output and standard error, or None if the program succeeded. This is
+                 only computed on first access.
+        """
         if self.returncode == 0:
-            self.error_msg = None
-            return
-
-        self.error_msg = "Non-zero exit code {} from {}.".format(
-            self.returncode,
-            self.invocation_details_str,
-            self.returncode, cmd_line_args_to_str)
+            return None
 
-        self.error_msg += self.get_user_friendly_stdout_msg()
-        self.error_msg += self.get_user_friendly_stderr_msg()
-        self.error_msg = self.error_msg.rstrip()
+        if self._error_msg is None:
+            self._error_msg = ''.join([
+                "Non-zero exit code {} from {}.".format(
+                    self.returncode, self.invocation_details_str),
+                self.get_user_friendly_stdout_msg(),
+                self.get_user_friendly_stderr_msg()
+            ]).rstrip()
+        return self._error_msg
 
     def get_stdout(self):
         if self.stdout is not None:
@@ -115,13 +207,19 @@ class ProgramResult:
         assert stream_type in ['output', 'error']
         if stream_type == 'output':
             value = self.get_stdout()
+            truncated = self.stdout_truncated
         else:
             value = self.get_stderr()
-        if value is None or not value.strip():
+            truncated = self.stderr_truncated
+        # Unlike strip(), isspace() does not copy the value and stops at the first non-whitespace
+        # character.
+        if not value or value.isspace():
             return ""
         value = value.rstrip()
-        return "\nStandard {} from {}:\n{}\n(end of standard {})\n".format(
-            stream_type, self.invocation_details_str,
+        return "\nStandard {}{} from {}:\n{}\n(end of standard {})\n".format(
+            stream_type,
+            ' (truncated)' if truncated else '',
+            self.invocation_details_str,
             trim_long_text(value, self.max_lines_to_show),
             stream_type)
 
@@ -153,38 +251,229 @@ class ProgramResult:
             self.raise_error_if_failed()
 
 
+def _get_invocation_details_str(cmd_line_str, work_dir, stdout_path, stderr_path):
+    """
+    :return: a description of an external program invocation to use in log and error messages
+    """
+    current_dir = None
+    if not work_dir:
+        work_dir = current_dir = os.getcwd()
+    invocation_details_str = "external program {{ %s }} running in '%s'" % (
+            cmd_line_str, work_dir)
+    if stdout_path is not None:
+        def get_abs_path(path):
+            # Relative output paths are relative to the current directory of this process. Reuse
+            # it if we already know it instead of letting os.path.abspath look it up again.
+            if current_dir is None:
+                return os.path.abspath(path)
+            return os.path.normpath(os.path.join(current_dir, path))
+
+        invocation_details_str += ", saving stdout to {{ %s }}, stderr to {{ %s }}" % (
+            # For the ease of copying and pasting, convert to absolute paths.
+            get_abs_path(stdout_path),
+            get_abs_path(stderr_path)
+        )
+    return invocation_details_str
+
+
 class ExternalProgramError(Exception):
     def __init__(self, message, result):
         self.message = message
         self.result = result
 
 
+class _WorkDirStack(threading.local):
+    """
+    Per-thread stack of working directories set using :py:class:`WorkDirContext`.
+    """
+    def __init__(self):
+        self.dirs = []
+
+
+_work_dir_stack = _WorkDirStack()
+
+
+def _get_work_dir(cwd=None):
+    """
+    :param cwd: the working directory explicitly requested for an external program, if any
+    :return: the directory to run an external program in, taking the innermost
+             :py:class:`WorkDirContext` of the current thread into account, or None if the program
+             should run in the current directory of this process.
+    """
+    dirs = _work_dir_stack.dirs
+    if not dirs:
+        return cwd
+    if cwd is None:
+        return dirs[-1]
+    return os.path.join(dirs[-1], cwd)
+
+
 class WorkDirContext:
     """
-    Allows setting a working directory context for running external programs. The directory will
-    be changed to the given directory on entering the block, and will be restored to the old
-    directory on exit.
+    Allows setting a working directory context for running external programs. Programs started
+    using :py:func:`run_program` from the same thread inside of the block run in the given
+    directory. The current directory of this process is not changed, so this is safe to use
+    from multiple threads at the same time. Relative directories are interpreted relative to the
+    enclosing :py:class:`WorkDirContext`, if any.
 
     .. code-block:: python
 
        with WorkDirContext('/tmp'):
            run_program('ls')
+
+    Note that this used to change the current directory of the whole process, and no longer does.
+    As a result, inside of the block:
+
+    * Programs started using :py:func:`run_program` from other threads, including threads started
+      inside of the block (e.g. by a ``ThreadPoolExecutor``), do not run in the given directory.
+      Use :py:func:`run_programs`, which runs all of its programs in the given directory, or pass
+      the directory as ``cwd`` explicitly.
+    * Relative paths opened by this process, and programs started using ``subprocess`` directly,
+      are still relative to the current directory of the process.
     """
     def __init__(self, work_dir):
-        self.thread_local = threading.local()
         self.work_dir = work_dir
 
     def __enter__(self):
-        self.thread_local.old_dir = os.getcwd()
-        os.chdir(self.work_dir)
+        work_dir = os.path.abspath(_get_work_dir(self.work_dir))
+        # Fail here, the same way os.chdir would, rather than when a program is started.
+        if not os.path.isdir(work_dir):
+            error_code = errno.ENOTDIR if os.path.exists(work_dir) else errno.ENOENT
+            raise OSError(error_code, os.strerror(error_code), work_dir)
+        _work_dir_stack.dirs.append(work_dir)
 
     def __exit__(self, exception_type, exception_value, traceback):
-        os.chdir(self.thread_local.old_dir)
+        _work_dir_stack.dirs.pop()
+
+
+def _split_simple_shell_command(cmd_line_str):
+    """
+    :return: the list of arguments of the given shell command line if it is a simple command that
+             can be run without a shell, or None otherwise. This is the case if the command line
+             does not use any shell syntax beyond separating arguments with spaces, and does not
+             start with a variable assignment or a shell keyword or builtin command.
+    """
+    if not _SIMPLE_SHELL_COMMAND_CHARS.issuperset(cmd_line_str):
+        return None
+    args = cmd_line_str.split()
+    if not args or '=' in args[0] or args[0] in _SHELL_KEYWORDS_AND_BUILTINS:
+        return None
+    return args
+
+
+def _get_inheritable_fds():
+    """
+    :return: the file descriptors of this process, other than standard input, output, and error,
+             that would be inherited by child processes
+    """
+    fds = []
+    for fd_str in os.listdir(_OPEN_FDS_DIR):
+        fd = int(fd_str)
+        if fd > 2:
+            try:
+                if os.get_inheritable(fd):
+                    fds.append(fd)
+            except OSError:
+                # E.g. the descriptor that was used to list the directory, closed by now.
+                pass
+    return fds
+
+
+def _spawn(args, stdout_file=None, stderr_file=None):
+    """
+    Starts a program using os.posix_spawnp, which is cheaper than the fork used by Popen in a
+    process with a large memory footprint. The program inherits the standard input, as well as the
+    current directory of this process. Same as with Popen, other file descriptors are not passed to
+    the program.
+
+    :param stdout_file: an open file to redirect standard output to. If not specified, standard
+                        output is inherited from this process.
+    :param stderr_file: similar to ``stdout_file`` but for standard error.
+    :return: the process id of the program
+    """
+    file_actions = [
+        (os.POSIX_SPAWN_DUP2, output_file.fileno(), fd)
+        for output_file, fd in [(stdout_file, 1), (stderr_file, 2)] if output_file is not None
+    ]
+    # Popen closes all file descriptors other than the standard ones in the child process by
+    # default (close_fds=True). Do the same for the descriptors that would otherwise be inherited.
+    file_actions.extend((os.POSIX_SPAWN_CLOSE, fd) for fd in _get_inheritable_fds())
+    return os.posix_spawnp(args[0], args, os.environ, file_actions=file_actions,
+                           setsigdef=_SIGNALS_TO_RESET_IN_CHILD)
+
+
+def _wait_for_pid(pid):
+    """
+    Waits for a program started using :py:func:`_spawn` to finish.
+
+    :return: the exit code of the program, or a negative signal number if the program was killed
+             by a signal, same as Popen.returncode
+    """
+    _, status = os.waitpid(pid, 0)
+    if os.WIFSIGNALED(status):
+        return -os.WTERMSIG(status)
+    return os.WEXITSTATUS(status)
+
+
+def _communicate_with_limit(process, max_output_bytes):
+    """
+    Similar to Popen.communicate, but only keeps up to the given number of bytes of standard output
+    and standard error each, and kills the process as soon as it produces more output than that.
+
+    :return: a tuple of standard output, standard error, and whether each of them was truncated
+    """
+    if process.stdin:
+        process.stdin.close()
+
+    stream_chunks = ([], [])
+    truncated = [False, False]
+    errors = [None, None]
+
+    def read_stream(i, stream):
+        try:
+            fd = stream.fileno()
+            num_bytes_left = max_output_bytes
+            while True:
+                chunk = os.read(fd, _OUTPUT_READ_CHUNK_SIZE)
+                if not chunk:
+                    break
+                if len(chunk) > num_bytes_left:
+                    stream_chunks[i].append(chunk[:num_bytes_left])
+                    truncated[i] = True
+                    process.kill()
+                    break
+                stream_chunks[i].append(chunk)
+                num_bytes_left -= len(chunk)
+        except Exception as ex:
+            errors[i] = ex
+            # The output is incomplete, and nothing reads the stream anymore, so do not let the
+            # program block on writing to it.
+            process.kill()
+        finally:
+            stream.close()
+
+    reader_threads = [
+        threading.Thread(target=read_stream, args=(i, stream))
+        for i, stream in enumerate((process.stdout, process.stderr))
+    ]
+    for thread in reader_threads:
+        thread.daemon = True
+        thread.start()
+    for thread in reader_threads:
+        thread.join()
+    process.wait()
+
+    for error in errors:
+        if error is not None:
+            raise error
+    return (b''.join(stream_chunks[0]), b''.join(stream_chunks[1]),
+            truncated[0], truncated[1])
 
 
 def run_program(args, error_ok=False, report_errors=None, capture_output=True,
                 max_lines_to_show=DEFAULT_MAX_LINES_TO_SHOW, cwd=None, shell=None,
-                stdout_path=None, stderr_path=None, stdout_stderr_prefix=None, **kwargs):
+                stdout_path=None, stderr_path=None, stdout_stderr_prefix=None,
+                max_output_bytes=None, **kwargs):
     """
     Run the given program identified by its argument list, and return a :py:class:`ProgramResult`
     object.
@@ -200,11 +489,15 @@ def run_program(args, error_ok=False, report_errors=None, capture_output=True,
                      fails.
     :param stdout_path: instead of trying to capture all standard output in memory, save it
         to this file. Both `stdout_file_path` and `stderr_file_path` have to be specified or
-        unspecified at the same time. Also `shell` has to be true in this mode as we are using
-        shell redirections to implement this.
+        unspecified at the same time. Relative paths are interpreted relative to the working
+        directory of the program.
     :param stderr_path: similar to ``stdout_file_path`` but for standard error.
     :param stdout_stderr_prefix: allows setting both `stdout_path` and `stderr_path` quickly.
         Those variables are set to the value of this parameter with `.out` and `.err` appended.
+    :param max_output_bytes: if specified, at most this many bytes of standard output and standard
+        error each are captured. A program that produces more output than that is killed, and the
+        ``stdout_truncated`` or ``stderr_truncated`` attribute of the result is set, depending on
+        which output was cut. Only used with ``capture_output``.
     """
     if isinstance(args, str) and shell is None:
         # If we are given a single string, assume it is a command line to be executed in a shell.
@@ -215,20 +508,16 @@ def run_program(args, error_ok=False, report_errors=None, capture_output=True,
         cmd_line_str = args
         args = [args]
     else:
-        if isinstance(args, tuple):
-            args = list(args)
-
-        if isinstance(args, str):
-            args = [args]
-
-        def normalize_arg(arg):
-            if isinstance(arg, int):
-                return str(arg)
-            return arg
+        # Integer arguments are converted to strings, everything else is passed through as is.
+        args = [str(arg) if isinstance(arg, int) else arg for arg in args]
 
-        args = [normalize_arg(arg) for arg in args]
+        # Quoting all arguments into a single command line string is only done when it is needed.
+        cmd_line_str = cmd_line_args_to_str(args) if shell else None
 
-        cmd_line_str = cmd_line_args_to_str(args)
+    def get_invocation_details_str():
+        return _get_invocation_details_str(
+            cmd_line_args_to_str(args) if cmd_line_str is None else cmd_line_str,
+            cwd, stdout_path, stderr_path)
 
     if (stdout_path is None) != (stderr_path is None):
         raise ValueError(
@@ -246,73 +535,101 @@ def run_program(args, error_ok=False, report_errors=None, capture_output=True,
         stderr_path = stdout_stderr_prefix + '.err'
         output_to_files = True
 
-    if output_to_files and not shell:
-        raise ValueError("If {stdout,stderr}_to_file are specified, shell must be True")
-
-    invocation_details_str = "external program {{ %s }} running in '%s'" % (
-            cmd_line_str, cwd or os.getcwd())
-
-    if output_to_files:
-        cmd_line_str = '( %s ) >%s 2>%s' % (
-            cmd_line_str,
-            quote_for_bash(stdout_path),
-            quote_for_bash(stderr_path)
-        )
-        invocation_details_str += ", saving stdout to {{ %s }}, stderr to {{ %s }}" % (
-            # For the ease of copying and pasting, convert to absolute paths.
-            os.path.abspath(stdout_path),
-            os.path.abspath(stderr_path)
-        )
+    cwd = _get_work_dir(cwd)
+    if output_to_files and cwd is not None:
+        # The program creates the output files relative to its own working directory, but we read
+        # them relative to the current directory of this process.
+        stdout_path = os.path.join(cwd, stdout_path)
+        stderr_path = os.path.join(cwd, stderr_path)
 
     if is_verbose_mode():
-        logging.info("Running %s", invocation_details_str)
+        logging.info("Running %s", get_invocation_details_str())
 
-    tmp_script_path = None
+    stdout_file = None
+    stderr_file = None
     try:
-        output_redirection = subprocess.PIPE if (capture_output and not output_to_files) else None
-        args_to_run = args
-        if shell:
-            # Save the script to a temporary file to avoid anomalies with backslash un-escaping
-            # described at http://bit.ly/2SFoMpN (on Ubuntu 18.04).
-            with tempfile.NamedTemporaryFile(suffix='.sh', delete=False) as tmp_script_file:
-                tmp_script_file.write(cmd_line_str.encode('utf-8'))
-                tmp_script_path = tmp_script_file.name
-                args_to_run = os.getenv('SHELL', DEFAULT_UNIX_SHELL) + ' ' + quote_for_bash(
-                    tmp_script_path)
-
-        program_subprocess = subprocess.Popen(
-            args_to_run,
-            stdout=output_redirection,
-            stderr=output_redirection,
-            shell=shell,
-            cwd=cwd,
-            **kwargs)
-
-        program_stdout, program_stderr = program_subprocess.communicate()
         if output_to_files:
-            def report_unexpected_output(stream_name, output):
-                if output is not None and output.strip():
-                    logging.warn(
-                        "Unexpected standard %s from %s (should have been redirected):\n%s",
-                        stream_name, invocation_details_str, output)
-
-            report_unexpected_output('output', program_stdout)
-            report_unexpected_output('error', program_stderr)
+            # Let the program write directly to the output files, with no shell redirections.
+            stdout_file = open(stdout_path, 'wb')
+            stderr_file = open(stderr_path, 'wb')
+            stdout_redirection = stdout_file
+            stderr_redirection = stderr_file
+        elif capture_output:
+            stdout_redirection = subprocess.PIPE
+            stderr_redirection = subprocess.PIPE
+        else:
+            stdout_redirection = None
+            stderr_redirection = None
+
+        def start_program(args_to_run, use_posix_spawn):
+            if use_posix_spawn:
+                return _spawn(args_to_run, stdout_file, stderr_file)
+            return subprocess.Popen(
+                args_to_run,
+                stdout=stdout_redirection,
+                stderr=stderr_redirection,
+                cwd=cwd,
+                **kwargs)
+
+        # With nothing to capture and nothing to set up in the child process other than output
+        # files, we can use os.posix_spawnp instead of Popen.
+        can_use_posix_spawn = (
+            stdout_redirection is not subprocess.PIPE and cwd is None and not kwargs and
+            hasattr(os, 'posix_spawnp') and _OPEN_FDS_DIR is not None)
+
+        direct_args = None if shell else args
+        if shell and not kwargs:
+            # Simple commands are run directly, without starting a shell first. Extra arguments,
+            # e.g. executable, are meant for the shell, so they turn this off.
+            direct_args = _split_simple_shell_command(cmd_line_str)
+
+        program_subprocess = None
+        if direct_args is not None:
+            try:
+                program_subprocess = start_program(direct_args, can_use_posix_spawn)
+            except OSError:
+                if not shell:
+                    raise
+                # Let the shell run the command and report the error if there is one, e.g. exit
+                # with code 127 if the program is not found.
+
+        if program_subprocess is None:
+            # Pass the script directly to the shell as an argument instead of using shell=True.
+            # That way it is not re-parsed by /bin/sh first, which avoids anomalies with backslash
+            # un-escaping described at http://bit.ly/2SFoMpN (on Ubuntu 18.04).
+            program_subprocess = start_program(
+                [os.getenv('SHELL', DEFAULT_UNIX_SHELL), '-c', cmd_line_str], can_use_posix_spawn)
+
+        stdout_truncated = False
+        stderr_truncated = False
+        if not isinstance(program_subprocess, subprocess.Popen):
+            returncode = _wait_for_pid(program_subprocess)
             program_stdout = None
             program_stderr = None
-
-    except OSError:
-        logging.error("Failed to run %s", invocation_details_str)
+        else:
+            if max_output_bytes is not None and stdout_redirection is subprocess.PIPE:
+                (program_stdout, program_stderr,
+                 stdout_truncated, stderr_truncated) = _communicate_with_limit(
+                    program_subprocess, max_output_bytes)
+            else:
+                program_stdout, program_stderr = program_subprocess.communicate()
+            returncode = program_subprocess.returncode
+
+    except (IOError, OSError):
+        logging.error("Failed to run %s", get_invocation_details_str())
         raise
 
     finally:
-        if tmp_script_path and os.path.exists(tmp_script_path):
-            os.remove(tmp_script_path)
+        for output_file in [stdout_file, stderr_file]:
+            if output_file is not None:
+                output_file.close()
 
     def cleanup_output(out_str):
         if out_str is None:
             return None
-        return decode_utf8(out_str)
+        # Decode the whole output in one call, and do not fail on programs that produce output
+        # that is not valid UTF-8.
+        return decode_utf8(out_str, errors='replace')
 
     clean_stdout = cleanup_output(program_stdout)
     clean_stderr = cleanup_output(program_stderr)
@@ -320,17 +637,19 @@ def run_program(args, error_ok=False, report_errors=None, capture_output=True,
     result = ProgramResult(
         cmd_line=args,
         cmd_line_str=cmd_line_str,
-        program_path=os.path.realpath(args[0]),
-        returncode=program_subprocess.returncode,
+        program_path=os.path.join(cwd, args[0]) if cwd is not None else args[0],
+        returncode=returncode,
         stdout=clean_stdout,
         stdout_path=stdout_path,
         stderr=clean_stderr,
         stderr_path=stderr_path,
-        invocation_details_str=invocation_details_str,
+        work_dir=cwd,
         max_lines_to_show=max_lines_to_show,
-        output_captured=capture_output)
+        output_captured=capture_output,
+        stdout_truncated=stdout_truncated,
+        stderr_truncated=stderr_truncated)
 
-    if program_subprocess.returncode != 0:
+    if returncode != 0:
         if report_errors is None:
             report_errors = not error_ok
         if report_errors:
@@ -341,6 +660,51 @@ def run_program(args, error_ok=False, report_errors=None, capture_output=True,
     return result
 
 
+def run_programs(arg_lists, concurrency=DEFAULT_CONCURRENCY, **kwargs):
+    """
+    Run a number of independent programs concurrently, using a pool of threads that each call
+    :py:func:`run_program`, and return their results once all of them have finished.
+
+    :param arg_lists: a list of arguments for each program to run, each element being a list of
+        arguments or a single string, same as the ``args`` parameter of :py:func:`run_program`.
+    :param concurrency: the maximum number of programs to run at the same time.
+    :param kwargs: additional keyword arguments to :py:func:`run_program` for every program.
+    :return: a list of :py:class:`ProgramResult` objects in the same order as ``arg_lists``
+    :raises ExternalProgramError: if any of the programs fails and ``error_ok`` is not set. This
+        is only raised after all programs have finished, for the first failed program in the list.
+    """
+    arg_lists = list(arg_lists)
+    # Worker threads do not see the WorkDirContext of the calling thread, so resolve it here.
+    kwargs['cwd'] = _get_work_dir(kwargs.get('cwd'))
+    results = [None] * len(arg_lists)
+    errors = [None] * len(arg_lists)
+    indexes = iter(range(len(arg_lists)))
+    indexes_lock = threading.Lock()
+
+    def worker():
+        while True:
+            with indexes_lock:
+                i = next(indexes, None)
+            if i is None:
+                return
+            try:
+                results[i] = run_program(arg_lists[i], **kwargs)
+            except Exception as ex:
+                errors[i] = ex
+
+    threads = [threading.Thread(target=worker)
+               for _ in range(max(1, min(concurrency, len(arg_lists))))]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    for error in errors:
+        if error is not None:
+            raise error
+    return results
+
+
 def check_run_program(*args, **kwargs):
     """
     Similar to subprocess.check_call but using our run_program facility.
@@ -351,6 +715,19 @@ def check_run_program(*args, **kwargs):
     return 0
 
 
+def _run_program_for_returncode(args, **kwargs):
+    """
+    Runs the given program without logging anything, and returns its exit code. Unless specified
+    otherwise in ``kwargs``, the output of the program is discarded by redirecting it to
+    /dev/null, so it does not have to be read through pipes.
+    """
+    if (kwargs.get('capture_output', True) and
+            all(kwargs.get(name) is None
+                for name in ['stdout_path', 'stderr_path', 'stdout_stderr_prefix'])):
+        kwargs.update(capture_output=False, stdout_path=os.devnull, stderr_path=os.devnull)
+    return run_program(args, error_ok=True, report_errors=False, **kwargs).returncode
+
+
 def program_fails_no_log(args, **kwargs):
     """
     Run the given program, and returns if it failed. Does not log anything in case of success
@@ -358,9 +735,9 @@ def program_fails_no_log(args, **kwargs):
 
     :param args: command line arguments or a single string to run as a shell command
     :param kwargs: additional keyword arguments for subprocess.Popen
-    :return: ``True`` if the program succeeded
+    :return: ``True`` if the program failed
     """
-    return run_program(args, error_ok=True, report_errors=False, **kwargs).failure()
+    return _run_program_for_returncode(args, **kwargs) != 0
 
 
 def program_succeeds_no_log(args, **kwargs):
@@ -370,9 +747,9 @@ def program_succeeds_no_log(args, **kwargs):
 
     :param args: command line arguments or a single string to run as a shell command
     :param kwargs: additional keyword arguments for subprocess.Popen
-    :return: ``True`` if the program failed
+    :return: ``True`` if the program succeeded
     """
-    return run_program(args, error_ok=True, report_errors=False, **kwargs).success()
+    return _run_program_for_returncode(args, **kwargs) == 0
 
 
 def program_succeeds_empty_output(args, **kwargs):
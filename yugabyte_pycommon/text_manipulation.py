@@ -12,15 +12,24 @@
 
 
 import os
-import re
+import string
+
+
+# Characters that never need to be quoted when passed to Bash, the same set as the one used by
+# shlex.quote. An argument consisting of anything else is quoted.
+_BASH_SAFE_CHARS = frozenset(string.ascii_letters + string.digits + '@%+=:,./-_')
+
+# Values of boolean environment variables that are considered true (after stripping and
+# converting to lower case).
+_TRUE_ENV_VAR_VALUES = frozenset(['1', 't', 'true', 'y', 'yes'])
 
 
 def quote_for_bash(s):
     if s == '':
         return "''"
-    if re.search(r"""[ ;'"${}()\\.*]""", s):
-        return "'" + s.replace("'", r"'\''") + "'"
-    return s
+    if _BASH_SAFE_CHARS.issuperset(s):
+        return s
+    return "'" + s.replace("'", r"'\''") + "'"
 
 
 def safe_path_join(*args):
@@ -38,8 +47,10 @@ def safe_path_join(*args):
     """
     if not args or args[0] is None:
         return None
-    args = [arg for arg in args if arg is not None]
-    return os.path.join(*args)
+    if None not in args:
+        return os.path.join(*args)
+    # The first argument is not None here, so there is always at least one argument to join.
+    return os.path.join(*[arg for arg in args if arg is not None])
 
 
 def cmd_line_args_to_str(args):
@@ -62,8 +73,11 @@ def trim_long_text(text, max_lines):
     """
     max_lines = max(max_lines, 3)
 
-    lines = text.splitlines()
-    if len(lines) <= max_lines:
+    # A trailing newline terminates the last line rather than starting a new one. Counting
+    # newlines does not allocate anything, so short texts are returned without splitting them.
+    num_trailing_newlines = 1 if text.endswith('\n') else 0
+    num_lines = text.count('\n', 0, len(text) - num_trailing_newlines) + 1
+    if num_lines <= max_lines:
         return text
 
     # Here is the math involved:
@@ -71,21 +85,43 @@ def trim_long_text(text, max_lines):
     # lines_at_each_end <= (max_lines - 1) / 2
     lines_to_keep_at_each_end = int((max_lines - 1) / 2)
 
-    num_lines_skipped = len(lines) - lines_to_keep_at_each_end * 2
-    if num_lines_skipped <= 0:
-        return text
-
-    return "\n".join(
-        lines[:lines_to_keep_at_each_end] +
-        ['({} lines skipped)'.format(num_lines_skipped)] +
-        lines[-lines_to_keep_at_each_end:]
-    )
-
+    num_lines_skipped = num_lines - lines_to_keep_at_each_end * 2
+
+    # Find where the lines we are going to keep at each end start and finish, so that only those
+    # parts of the text are copied.
+    head_end = -1
+    for _ in range(lines_to_keep_at_each_end):
+        head_end = text.find('\n', head_end + 1)
+    text_end = len(text) - num_trailing_newlines
+    tail_start = text_end
+    for _ in range(lines_to_keep_at_each_end):
+        tail_start = text.rfind('\n', 0, tail_start)
+
+    # Lines may also be terminated by "\r\n". The kept lines are joined with "\n", the same way
+    # as lines that are split and joined again, so a "\r" is not left at the end of either part.
+    head = text[:head_end].replace('\r\n', '\n')
+    tail = text[tail_start + 1:text_end].replace('\r\n', '\n')
+    if head.endswith('\r'):
+        head = head[:-1]
+    if tail.endswith('\r'):
+        tail = tail[:-1]
+
+    return "\n".join([
+        head,
+        '({} lines skipped)'.format(num_lines_skipped),
+        tail
+    ])
+
+
+def decode_utf8(bytes, errors='strict'):
+    """
+    Decodes the given bytes as UTF-8. Strings are returned unchanged.
 
-def decode_utf8(bytes):
+    :param errors: how to handle invalid UTF-8 sequences, as in ``bytes.decode``
+    """
     if isinstance(bytes, str):
         return bytes
-    return bytes.decode('utf-8')
+    return bytes.decode('utf-8', errors)
 
 
 def get_bool_env_var(env_var_name):
@@ -116,5 +152,5 @@ def get_bool_env_var(env_var_name):
     if value is None:
         return False
 
-    return value.strip().lower() in ['1', 't', 'true', 'y', 'yes']
+    return value.strip().lower() in _TRUE_ENV_VAR_VALUES
 
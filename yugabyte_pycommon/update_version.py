@@ -43,7 +43,7 @@ if __name__ == '__main__':
         max_version = '0.1.0'
 
     diff_vs_max_version_tag = subprocess.check_output(
-            ['git', 'diff', '--name-only', 'v%s' % max_version, 'HEAD']).strip().decode('utf-8')
+            ['git', 'diff', '--name-only', 'v%s' % max_version, 'HEAD']).strip()
     version_file_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'version.py')
     if not diff_vs_max_version_tag:
         sys.path.insert(0, os.path.dirname(os.path.dirname(__file__)))
@@ -56,7 +56,7 @@ if __name__ == '__main__':
                   (version.__version__, max_version))
     else:
         print("Found differences between max version from tag %s and HEAD:\n%s" % (
-            max_version, diff_vs_max_version_tag))
+            max_version, diff_vs_max_version_tag.decode('utf-8')))
 
     new_version = semver.bump_patch(max_version)
     with open(version_file_path, 'w') as version_file: